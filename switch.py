@@ -2,17 +2,79 @@
 """
 Simple Tkinter GUI for controlling TP-Link Kasa smart home devices.
 Requires: pip install python-kasa
+Optional: pip install python-dotenv (to read credentials from a .env file)
 """
 
 import asyncio
+import functools
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import threading
 import os
+import time
 from kasa import Discover
 
+try:
+    from kasa import KasaException
+except ImportError:
+    # python-kasa < 0.6
+    from kasa import SmartDeviceException as KasaException
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    def load_dotenv(dotenv_path=".env", *args, **kwargs):
+        """Fallback when python-dotenv is not installed"""
+        if os.path.exists(dotenv_path):
+            print(f"Found {dotenv_path} but python-dotenv is not installed, so it was not loaded. "
+                  "Run 'pip install python-dotenv' or set KASA_USERNAME/KASA_PASSWORD in the environment.")
+        return False
+
+
+# Errors expected from talking to a device over the network
+_DEVICE_ERRORS = (KasaException, asyncio.TimeoutError, OSError)
+
+# Fixed display strings shared by every treeview row
+_STATUS_ON = "🟢 ON"
+_STATUS_OFF = "⚫ OFF"
+_STATUS_UNK = "⚪ Unknown"
+_TOGGLE = "Toggle"
+
+# Extra rows attached below the visible part of the device window
+_ROW_BUFFER = 2
+
+# Status text and row tag for each cached on/off state
+_STATUS_ROWS = {
+    True: (_STATUS_ON, 'online'),
+    False: (_STATUS_OFF, 'offline'),
+    None: (_STATUS_UNK, 'unknown'),
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _icon_for_type(type_name):
+    """Get appropriate icon for a device type name"""
+    type_name = type_name.lower()
+    if 'plug' in type_name:
+        return '🔌'
+    elif 'bulb' in type_name or 'light' in type_name:
+        return '💡'
+    elif 'switch' in type_name:
+        return '⚡'
+    elif 'strip' in type_name:
+        return '🔗'
+    return '📱'
+
 
 class KasaDeviceGUI:
+    __slots__ = (
+        'root', 'colors', 'devices', 'credentials', 'loop', 'tree',
+        'scrollbar', 'stats_labels', 'tree_tags', 'search_var', 'status_var',
+        '_alias', '_icon', '_label', '_search_key', '_is_on', '_available',
+        '_fetched_at', '_ttl', '_refreshing', '_displayed', '_sorted_ips', '_attached',
+        '_window_start', '_row_height', '_discovery_rounds', '_creds_kwargs',
+        '_net_sem', '_pending', '_running', '_search_after_id',
+    )
+
     def __init__(self, root):
         self.root = root
         self.root.title("🏠 Kasa Smart Home Controller")
@@ -36,11 +98,42 @@ class KasaDeviceGUI:
         
         # Store discovered devices
         self.devices = {}
+
+        # Cached per-device display state, keyed by IP
+        self._alias = {}
+        self._icon = {}
+        self._label = {}
+        self._search_key = {}
+        self._is_on = {}
+        self._available = {}
+
+        # When each device's state was last read, and how long that reading stays fresh
+        self._fetched_at = {}
+        self._ttl = 30.0
+        self._refreshing = set()
+
+        # Label and on/off state currently shown in the treeview, keyed by IP
+        self._displayed = {}
+
+        # Devices matching the search, and the window of them attached to the tree
+        self._sorted_ips = []
+        self._attached = []
+        self._window_start = 0
+
+        # Number of concurrent discovery broadcasts merged per discovery
+        self._discovery_rounds = 3
+
         self.credentials = self._load_credentials_from_env()
+        if self.credentials["username"] and self.credentials["password"]:
+            self._creds_kwargs = dict(self.credentials)
+        else:
+            self._creds_kwargs = {}
         
-        # Create a persistent event loop for async operations
+        # Create the event loop that is driven from the Tk main loop
         self.loop = None
-        self.loop_thread = None
+        self._net_sem = None
+        self._pending = set()
+        self._running = False
         self._start_event_loop()
         
         # Create GUI elements
@@ -78,12 +171,13 @@ class KasaDeviceGUI:
                        font=('Segoe UI', 10))
 
         # Configure treeview with better contrast
+        self._row_height = 25
         style.configure('Modern.Treeview',
                        background='white',
                        foreground='black',
                        fieldbackground='white',
                        font=('Segoe UI', 10),
-                       rowheight=25)
+                       rowheight=self._row_height)
 
         style.configure('Modern.Treeview.Heading',
                        background=self.colors['light'],
@@ -105,31 +199,13 @@ class KasaDeviceGUI:
         }
 
     def _load_credentials_from_env(self):
-        """Load credentials from .env file"""
-        credentials = {"username": "", "password": ""}
-
-        env_file = ".env"
-        if os.path.exists(env_file):
-            try:
-                with open(env_file, 'r') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            if '=' in line:
-                                key, value = line.split('=', 1)
-                                key = key.strip()
-                                value = value.strip().strip('"').strip("'")
-
-                                if key == "KASA_USERNAME":
-                                    credentials["username"] = value
-                                elif key == "KASA_PASSWORD":
-                                    credentials["password"] = value
-                print(f"Loaded credentials from {env_file}: username={'*' * len(credentials['username']) if credentials['username'] else 'not set'}")
-            except Exception as e:
-                print(f"Error reading {env_file}: {e}")
-        else:
-            print(f"No {env_file} file found. Create one with KASA_USERNAME and KASA_PASSWORD if needed.")
-
+        """Load credentials from the environment, falling back to a .env file"""
+        load_dotenv(".env", override=False)
+        credentials = {
+            "username": os.environ.get("KASA_USERNAME", ""),
+            "password": os.environ.get("KASA_PASSWORD", ""),
+        }
+        print(f"Loaded credentials: username={'*' * len(credentials['username']) if credentials['username'] else 'not set'}")
         return credentials
     
     def setup_gui(self):
@@ -164,8 +240,9 @@ class KasaDeviceGUI:
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=20, font=('Segoe UI', 10))
         search_entry.grid(row=0, column=1)
         search_entry.insert(0, "Search devices...")
-        # Add trace after GUI is fully initialized
-        self.search_var.trace('w', self.on_search_changed)
+        # Filter once typing pauses rather than on every keystroke
+        self._search_after_id = None
+        search_entry.bind('<KeyRelease>', self._schedule_search)
         
         # Control buttons frame
         control_frame = ttk.Frame(main_frame)
@@ -240,21 +317,25 @@ class KasaDeviceGUI:
         self.tree.column("Status", width=120, anchor=tk.CENTER)
         self.tree.column("Control", width=80, anchor=tk.CENTER)
         
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(devices_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        # Add scrollbar; it tracks the device window rather than the tree contents
+        self.scrollbar = ttk.Scrollbar(devices_frame, orient=tk.VERTICAL, command=self._on_scroll)
         
         # Grid the treeview and scrollbar
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
 
         # Configure treeview tags for colored text
-        self.tree.tag_configure('online', foreground=self.colors['success'], font=('Segoe UI', 10, 'bold'))
-        self.tree.tag_configure('offline', foreground=self.colors['danger'], font=('Segoe UI', 10))
-        self.tree.tag_configure('unknown', foreground='#7f8c8d', font=('Segoe UI', 10))
+        for tag, options in self.tree_tags.items():
+            self.tree.tag_configure(tag, **options)
 
         # Bind double-click to toggle device
         self.tree.bind("<Double-1>", self.on_device_double_click)
+
+        # Re-window the device rows on resize and mouse wheel
+        self.tree.bind("<Configure>", self._on_tree_resized)
+        self.tree.bind("<MouseWheel>", self._on_mouse_wheel)
+        self.tree.bind("<Button-4>", self._on_mouse_wheel)
+        self.tree.bind("<Button-5>", self._on_mouse_wheel)
         
         # Status bar with modern styling
         status_frame = ttk.Frame(main_frame, style='Card.TFrame')
@@ -267,24 +348,97 @@ class KasaDeviceGUI:
         status_label = ttk.Label(status_frame, textvariable=self.status_var, style='Status.TLabel')
         status_label.grid(row=0, column=1, sticky=tk.W, pady=8)
 
-    def on_search_changed(self, *args):
+    def _schedule_search(self, event=None):
+        """Debounce search input before filtering devices"""
+        if self._search_after_id is not None:
+            self.root.after_cancel(self._search_after_id)
+        self._search_after_id = self.root.after(150, self._apply_search)
+
+    def _apply_search(self):
         """Filter devices based on search input"""
-        # Check if tree widget exists yet
-        if not hasattr(self, 'tree'):
-            return
+        self._search_after_id = None
+        self._apply_filter()
+        self._window_start = 0
+        self._render_window()
 
+    def _apply_filter(self):
+        """Recompute the devices matching the search term"""
         search_term = self.search_var.get().lower()
         if search_term == "search devices...":
             search_term = ""
 
-        for item in self.tree.get_children():
-            values = self.tree.item(item)['values']
-            if values:
-                device_text = ' '.join(str(v).lower() for v in values)
-                if search_term in device_text:
-                    self.tree.reattach(item, '', 'end')
-                else:
-                    self.tree.detach(item)
+        search_key = self._search_key
+        self._sorted_ips = [
+            ip for ip in self._displayed
+            if search_term in search_key[ip]
+        ]
+
+    def _visible_row_count(self):
+        """Number of device rows that fit in the treeview, excluding the heading"""
+        if not self.tree.winfo_ismapped():
+            return int(self.tree.cget('height'))
+
+        # The first row starts just below the heading; assume one row height
+        # for the heading until a row is attached to measure it
+        heading = self._row_height
+        if self._attached:
+            box = self.tree.bbox(self._attached[0])
+            if box:
+                heading = box[1]
+        return max(1, (self.tree.winfo_height() - heading) // self._row_height)
+
+    def _render_window(self):
+        """Attach only the matching devices inside the visible window to the tree"""
+        rows = self._visible_row_count()
+        total = len(self._sorted_ips)
+        start = max(0, min(self._window_start, total - rows))
+        self._window_start = start
+        window = self._sorted_ips[start:start + rows + _ROW_BUFFER]
+
+        if window != self._attached:
+            visible = set(window)
+            stale = [ip for ip in self._attached if ip not in visible]
+            if stale:
+                self.tree.detach(*stale)
+            for index, ip in enumerate(window):
+                self.tree.reattach(ip, '', index)
+            self._attached = window
+        self.tree.yview_moveto(0)
+
+        # Re-read devices on screen whose cached state has expired
+        now = time.monotonic()
+        for ip in window:
+            if ip not in self._refreshing and now - self._fetched_at.get(ip, now) > self._ttl:
+                self._refreshing.add(ip)
+                self.run_async(self._refresh_one(ip))
+
+        if total:
+            self.scrollbar.set(start / total, min(1.0, (start + rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_scroll(self, *args):
+        """Move the device window in response to the scrollbar"""
+        if args[0] == 'moveto':
+            self._window_start = int(float(args[1]) * len(self._sorted_ips))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= self._visible_row_count()
+            self._window_start += step
+        self._render_window()
+
+    def _on_mouse_wheel(self, event):
+        """Scroll the device window with the mouse wheel"""
+        if event.num == 4 or event.delta > 0:
+            self._on_scroll('scroll', -3, 'units')
+        else:
+            self._on_scroll('scroll', 3, 'units')
+        return "break"
+
+    def _on_tree_resized(self, event):
+        """Re-window the device rows when the treeview is resized"""
+        self._render_window()
 
     def update_statistics(self):
         """Update device statistics display"""
@@ -292,65 +446,51 @@ class KasaDeviceGUI:
         if not hasattr(self, 'stats_labels'):
             return
 
-        total = len(self.devices)
-        online = 0
-        offline = 0
-        active = 0
-
-        for device in self.devices.values():
-            try:
-                # Check if device is available (online)
-                is_available = True  # Default to available
-                if hasattr(device, 'is_available'):
-                    is_available = device.is_available
-                elif hasattr(device, 'available'):
-                    is_available = device.available
-
-                if is_available:
-                    online += 1
-                else:
-                    offline += 1
-
-                # Check if device is active (turned on)
-                if hasattr(device, 'is_on') and device.is_on:
-                    active += 1
-
-            except Exception as e:
-                print(f"Error checking device status: {e}")
-                offline += 1  # Count as offline if we can't check status
-
-        # If we couldn't determine online/offline status, assume all are online
-        if online == 0 and offline == 0 and total > 0:
-            online = total
+        total = len(self._is_on)
+        active = sum(1 for is_on in self._is_on.values() if is_on)
+        online = sum(self._available.values())
 
         self.stats_labels['total'].config(text=str(total))
         self.stats_labels['online'].config(text=str(online))
-        self.stats_labels['offline'].config(text=str(offline))
+        self.stats_labels['offline'].config(text=str(total - online))
         self.stats_labels['active'].config(text=str(active))
 
     def get_device_icon(self, device):
         """Get appropriate icon for device type"""
         if hasattr(device, 'device_type'):
-            device_type = str(device.device_type).lower()
-            if 'plug' in device_type:
-                return '🔌'
-            elif 'bulb' in device_type or 'light' in device_type:
-                return '💡'
-            elif 'switch' in device_type:
-                return '⚡'
-            elif 'strip' in device_type:
-                return '🔗'
-        return '📱'
-
-    def get_status_display(self, device):
-        """Get visual status display for device"""
+            return _icon_for_type(str(device.device_type))
+        return _icon_for_type(type(device).__name__)
+
+    def _recompute_device_cache(self, ip, device):
+        """Resolve and cache the display state of a device just read with update()"""
+        alias = getattr(device, 'alias', None) or f'Device at {ip}'
+        icon = self.get_device_icon(device)
+        if alias != self._alias.get(ip) or icon != self._icon.get(ip):
+            self._alias[ip] = alias
+            self._icon[ip] = icon
+            self._label[ip] = f"{icon} {alias}"
+            self._search_key[ip] = alias.lower()
+
         try:
-            if device.is_on:
-                return "🟢 ON"
-            else:
-                return "⚫ OFF"
-        except (AttributeError, Exception):
-            return "⚪ Unknown"
+            self._is_on[ip] = bool(device.is_on)
+        except AttributeError:
+            self._is_on[ip] = None
+
+        # Check if device is available (online), defaulting to available
+        if hasattr(device, 'is_available'):
+            self._available[ip] = bool(device.is_available)
+        elif hasattr(device, 'available'):
+            self._available[ip] = bool(device.available)
+        else:
+            self._available[ip] = True
+
+        self._fetched_at[ip] = time.monotonic()
+
+    def _forget_device(self, ip):
+        """Drop the cached display state of a device"""
+        for cache in (self._alias, self._icon, self._label, self._search_key,
+                      self._is_on, self._available, self._fetched_at):
+            cache.pop(ip, None)
 
     def manual_add_device(self):
         """Manually add a device by IP address"""
@@ -361,24 +501,16 @@ class KasaDeviceGUI:
     async def _manual_add_device(self, ip):
         """Async method to manually add a device"""
         try:
-            from kasa import Discover
             self.status_var.set(f"Connecting to device at {ip}...")
             
             # Try to discover single device
-            if self.credentials["username"] and self.credentials["password"]:
-                device = await Discover.discover_single(
-                    ip, 
-                    username=self.credentials["username"],
-                    password=self.credentials["password"],
-                    timeout=10
-                )
-            else:
-                device = await Discover.discover_single(ip, timeout=10)
+            device = await Discover.discover_single(ip, timeout=10, **self._creds_kwargs)
             
             if device:
                 # Test connectivity
-                await asyncio.wait_for(device.update(), timeout=10)
+                await self._guarded(device.update, timeout=10)
                 self.devices[ip] = device
+                self._recompute_device_cache(ip, device)
                 self.update_device_list()
                 self.status_var.set(f"Successfully added device: {getattr(device, 'alias', ip)}")
             else:
@@ -392,67 +524,147 @@ class KasaDeviceGUI:
     
     
     def _start_event_loop(self):
-        """Start a persistent event loop in a separate thread"""
-        def run_loop():
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            self.loop.run_forever()
-        
-        self.loop_thread = threading.Thread(target=run_loop)
-        self.loop_thread.daemon = True
-        self.loop_thread.start()
-        
-        # Wait for loop to be ready
-        import time
-        while self.loop is None:
-            time.sleep(0.01)
+        """Create the event loop used for async operations"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        # Limit concurrent device requests so constrained hardware isn't overloaded
+        self._net_sem = asyncio.Semaphore(5)
     
     def run_async(self, coro):
-        """Run async coroutine using the persistent event loop"""
+        """Schedule async coroutine on the event loop"""
         if self.loop and not self.loop.is_closed():
-            asyncio.run_coroutine_threadsafe(coro, self.loop)
+            task = self.loop.create_task(coro)
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
         else:
             print("Event loop not available")
     
+    async def tk_loop(self):
+        """Drive the Tk event loop cooperatively from asyncio"""
+        self._running = True
+        while self._running:
+            self.root.update()
+            if self._pending:
+                await asyncio.wait(self._pending, timeout=0.005)
+            else:
+                await asyncio.sleep(0.005)
+        
+        # Let cancelled operations unwind before the loop is closed
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+    
     def cleanup(self):
-        """Clean up the event loop when closing"""
-        if self.loop and not self.loop.is_closed():
-            self.loop.call_soon_threadsafe(self.loop.stop)
+        """Stop driving the Tk loop and cancel outstanding operations"""
+        self._running = False
+        for task in self._pending:
+            task.cancel()
+    
+    async def _guarded(self, request, timeout=10):
+        """Run a device request with bounded concurrency and a timeout"""
+        # Create the coroutine only once a slot is free, so requests
+        # cancelled while queued never leave an un-awaited coroutine
+        async with self._net_sem:
+            return await asyncio.wait_for(request(), timeout=timeout)
+    
+    async def _probe_device(self, ip, device, timeout):
+        """Update a device, returning (ip, device, error) instead of raising"""
+        try:
+            await self._guarded(device.update, timeout=timeout)
+            return ip, device, None
+        except _DEVICE_ERRORS as e:
+            return ip, device, e
+    
+    def _record_probe(self, ip, device, error):
+        """Cache the outcome of probing a known device, returning True on success"""
+        if error is None:
+            self._recompute_device_cache(ip, device)
+            return True
+
+        # A device that fails to respond is counted as offline
+        print(f"Failed to update device {ip}: {type(error).__name__} - {str(error)}")
+        self._available[ip] = False
+        self._fetched_at[ip] = time.monotonic()
+        return False
+    
+    async def _refresh_one(self, ip):
+        """Re-read a single device whose cached state has expired"""
+        try:
+            device = self.devices.get(ip)
+            if device is None or ip not in self._alias:
+                return
+            before = (self._alias[ip], self._is_on[ip], self._available[ip])
+            fetched_at = self._fetched_at.get(ip)
+            _, _, error = await self._probe_device(ip, device, timeout=10)
+            # Don't overwrite state recorded while this read was in flight
+            if ip not in self._alias or self._fetched_at.get(ip) != fetched_at:
+                return
+            self._record_probe(ip, device, error)
+            if (self._alias[ip], self._is_on[ip], self._available[ip]) != before:
+                self.update_device_list()
+        finally:
+            self._refreshing.discard(ip)
+    
+    async def _disconnect_devices(self, devices):
+        """Release connections held by device objects that are no longer used"""
+        closers = [device.disconnect() for device in devices if hasattr(device, 'disconnect')]
+        if closers:
+            await asyncio.gather(*closers, return_exceptions=True)
     
     async def _discover_devices(self):
         """Async method to discover devices"""
         try:
             self.status_var.set("Discovering devices...")
-            self.root.update()
             
-            # Discover devices with timeout and error handling
-            if self.credentials["username"] and self.credentials["password"]:
-                devices = await Discover.discover(
-                    username=self.credentials["username"],
-                    password=self.credentials["password"],
-                    timeout=10,
-                    discovery_timeout=5
-                )
-            else:
-                devices = await Discover.discover(
-                    timeout=10,
-                    discovery_timeout=5
-                )
+            # Discover devices with timeout and error handling. Broadcast replies
+            # are easily lost, so run several discovery rounds concurrently and
+            # merge their results by IP
+            rounds = await asyncio.gather(
+                *(Discover.discover(timeout=10, discovery_timeout=5, **self._creds_kwargs)
+                  for _ in range(self._discovery_rounds)),
+                return_exceptions=True
+            )
+            if not any(isinstance(r, dict) for r in rounds):
+                raise next(r for r in rounds if isinstance(r, BaseException))
+            
+            # Keep devices already known this session without probing them again;
+            # only the first object found for each new IP is kept
+            found = set()
+            new_devices = {}
+            unused = []
+            for result in rounds:
+                if not isinstance(result, dict):
+                    continue
+                for ip, device in result.items():
+                    found.add(ip)
+                    if ip in self.devices or ip in new_devices:
+                        unused.append(device)
+                    else:
+                        new_devices[ip] = device
             
-            # Filter out problematic devices and update them safely
-            working_devices = {}
-            for ip, device in devices.items():
-                try:
-                    # Try to update the device to test connectivity
-                    await asyncio.wait_for(device.update(), timeout=15)
+            # Update new devices concurrently to test connectivity
+            results = await asyncio.gather(
+                *(self._probe_device(ip, device, timeout=15) for ip, device in new_devices.items())
+            )
+            working_devices = {ip: device for ip, device in self.devices.items() if ip in found}
+
+            # Filter out problematic devices
+            for ip, device, error in results:
+                if error is None:
                     working_devices[ip] = device
+                    self._recompute_device_cache(ip, device)
                     print(f"Successfully connected to device at {ip}: {getattr(device, 'alias', 'Unknown')}")
-                except Exception as e:
-                    print(f"Skipping problematic device at {ip}: {type(e).__name__} - {str(e)}")
-                    continue
+                else:
+                    unused.append(device)
+                    print(f"Skipping problematic device at {ip}: {type(error).__name__} - {str(error)}")
             
+            # Drop devices that were not found again
+            for ip in [ip for ip in self.devices if ip not in working_devices]:
+                unused.append(self.devices[ip])
+                self._forget_device(ip)
             self.devices = working_devices
             self.update_device_list()
+            await self._disconnect_devices(unused)
             
             if working_devices:
                 self.status_var.set(f"Found {len(working_devices)} working device(s)")
@@ -469,44 +681,48 @@ class KasaDeviceGUI:
         self.run_async(self._discover_devices())
     
     def update_device_list(self):
-        """Update the device list in the treeview"""
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # Add discovered devices
-        for ip, device in self.devices.items():
-            try:
-                name = getattr(device, 'alias', f'Device at {ip}')
-
-                # Get visual status and device type
-                status = self.get_status_display(device)
-                device_icon = self.get_device_icon(device)
+        """Update the device list in the treeview, touching only changed rows"""
+        changed = False
+
+        # Remove devices that are no longer known
+        for ip in [ip for ip in self._displayed if ip not in self._alias]:
+            changed = True
+            self.tree.delete(ip)
+            del self._displayed[ip]
+            if ip in self._attached:
+                self._attached.remove(ip)
+
+        # Add or update devices from the cached display state
+        tree = self.tree
+        cached_is_on = self._is_on
+        displayed = self._displayed
+        for ip, label in self._label.items():
+            is_on = cached_is_on[ip]
+            shown = displayed.get(ip)
+            if shown is not None and shown[0] == label and shown[1] == is_on:
+                continue
+
+            # Create minimal display values
+            status, tag = _STATUS_ROWS[is_on]
+            values = (
+                label,                           # Device name with icon
+                status,                          # Status with text
+                _TOGGLE                          # Toggle control text
+            )
+
+            if shown is None:
+                # New rows start detached until the window brings them into view
+                tree.insert("", "end", iid=ip, values=values, tags=(tag,))
+                tree.detach(ip)
+            else:
+                tree.item(ip, values=values, tags=(tag,))
+            displayed[ip] = (label, is_on)
+            changed = True
 
-                # Determine color tag based on device status
-                try:
-                    if device.is_on:
-                        tag = 'online'
-                    else:
-                        tag = 'offline'
-                except (AttributeError, Exception):
-                    tag = 'unknown'
-
-                # Create minimal display values
-                values = (
-                    f"{device_icon} {name}",         # Device name with icon
-                    status,                          # Status with text
-                    "Toggle"                         # Toggle control text
-                )
-
-                self.tree.insert("", "end", iid=ip, values=values, tags=(tag,))
-
-            except Exception as e:
-                print(f"Error adding device {ip}: {e}")
-                # Add device anyway with minimal info
-                self.tree.insert("", "end", iid=ip, values=(
-                    f"📱 Device {ip}", "⚪ Unknown", "Toggle"
-                ), tags=('unknown',))
+        # Only re-filter and re-window when a row was added, changed or removed
+        if changed:
+            self._apply_filter()
+            self._render_window()
 
         # Update statistics
         self.update_statistics()
@@ -519,10 +735,15 @@ class KasaDeviceGUI:
             # Safely update device state with timeout
             try:
                 await asyncio.wait_for(device.update(), timeout=15)
-            except Exception as e:
+            except _DEVICE_ERRORS as e:
                 self.status_var.set(f"Device {ip} communication error: {type(e).__name__}")
                 return
             
+            # Skip devices dropped by a rediscovery while the update was in flight
+            if self.devices.get(ip) is not device:
+                return
+            self._recompute_device_cache(ip, device)
+            
             # Toggle the device
             try:
                 if device.is_on:
@@ -531,18 +752,17 @@ class KasaDeviceGUI:
                 else:
                     await asyncio.wait_for(device.turn_on(), timeout=15)
                     status = "Turned ON"
-            except Exception as e:
+            except _DEVICE_ERRORS as e:
                 self.status_var.set(f"Failed to toggle device: {type(e).__name__}")
                 return
             
-            self.status_var.set(f"Device {getattr(device, 'alias', ip)} {status}")
+            self.status_var.set(f"Device {getattr(device, 'alias', None) or ip} {status}")
+            if self.devices.get(ip) is not device:
+                return
             
-            # Update the display
-            await asyncio.sleep(0.5)
-            try:
-                await asyncio.wait_for(device.update(), timeout=15)
-            except Exception:
-                pass
+            # The command succeeded, so the new state is known without re-reading it
+            self._is_on[ip] = status == "Turned ON"
+            self._fetched_at[ip] = time.monotonic()
             self.update_device_list()
             
         except Exception as e:
@@ -561,42 +781,41 @@ class KasaDeviceGUI:
     
     async def _turn_all_devices(self, turn_on=True):
         """Async method to turn all devices on or off"""
+        pending = set()
         try:
             action = "on" if turn_on else "off"
             self.status_var.set(f"Turning all devices {action}...")
-            self.root.update()
             
             # Control devices with individual error handling
-            tasks = []
+            task_to_ip = {}
             for ip, device in self.devices.items():
                 if turn_on:
-                    task = asyncio.create_task(asyncio.wait_for(device.turn_on(), timeout=10))
+                    task = asyncio.create_task(self._guarded(device.turn_on, timeout=10))
                 else:
-                    task = asyncio.create_task(asyncio.wait_for(device.turn_off(), timeout=10))
-                tasks.append((ip, task))
+                    task = asyncio.create_task(self._guarded(device.turn_off, timeout=10))
+                task_to_ip[task] = ip
             
-            # Wait for all control operations to complete
+            # Report each control operation as soon as it completes
             successful = 0
             failed = 0
-            for ip, task in tasks:
-                try:
-                    await task
-                    successful += 1
-                except Exception as e:
-                    print(f"Failed to control device {ip}: {type(e).__name__} - {str(e)}")
-                    failed += 1
-            
-            # Update device states in parallel
-            await asyncio.sleep(1)
-            update_tasks = []
-            for ip, device in self.devices.items():
-                task = asyncio.create_task(asyncio.wait_for(device.update(), timeout=10))
-                update_tasks.append(task)
-            
-            # Wait for all updates with error handling
-            await asyncio.gather(*update_tasks, return_exceptions=True)
-            
-            self.update_device_list()
+            pending = set(task_to_ip)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    ip = task_to_ip[task]
+                    try:
+                        task.result()
+                        # The command succeeded, so the new state is known without re-reading it
+                        if ip in self._is_on:
+                            self._is_on[ip] = turn_on
+                            self._fetched_at[ip] = time.monotonic()
+                        successful += 1
+                    except _DEVICE_ERRORS as e:
+                        print(f"Failed to control device {ip}: {type(e).__name__} - {str(e)}")
+                        failed += 1
+                
+                self.update_device_list()
+                self.status_var.set(f"Turning all devices {action}... {successful} done, {failed} failed")
             
             if failed == 0:
                 self.status_var.set(f"All {successful} devices turned {action}")
@@ -608,6 +827,10 @@ class KasaDeviceGUI:
             self.status_var.set(error_msg)
             print(error_msg)
             messagebox.showerror("Control Error", f"Failed to control all devices:\n{str(e)}")
+        finally:
+            # asyncio.wait doesn't cancel its tasks when this coroutine is cancelled
+            for task in pending:
+                task.cancel()
     
     def turn_all_on(self):
         """Turn all devices on"""
@@ -627,23 +850,21 @@ class KasaDeviceGUI:
         """Async method to refresh device status"""
         try:
             self.status_var.set("Refreshing device status...")
-            self.root.update()
             
             # Update devices in parallel
-            update_tasks = []
-            for ip, device in self.devices.items():
-                task = asyncio.create_task(asyncio.wait_for(device.update(), timeout=10))
-                update_tasks.append((ip, task))
+            results = await asyncio.gather(
+                *(self._probe_device(ip, device, timeout=10) for ip, device in self.devices.items())
+            )
             
-            # Wait for all updates with error handling
             successful = 0
             failed = 0
-            for ip, task in update_tasks:
-                try:
-                    await task
+            for ip, device, error in results:
+                # Skip devices dropped by a rediscovery while the refresh was in flight
+                if self.devices.get(ip) is not device:
+                    continue
+                if self._record_probe(ip, device, error):
                     successful += 1
-                except Exception as e:
-                    print(f"Failed to update device {ip}: {type(e).__name__} - {str(e)}")
+                else:
                     failed += 1
             
             self.update_device_list()
@@ -674,11 +895,20 @@ def main():
     # Handle window closing
     def on_closing():
         app.cleanup()
-        root.quit()
-        root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
-    root.mainloop()
+    try:
+        app.loop.run_until_complete(app.tk_loop())
+    finally:
+        # Cancel and drain every remaining task, including per-device
+        # requests spawned by operations, before closing the loop
+        tasks = asyncio.all_tasks(app.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            app.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        app.loop.close()
+        root.destroy()
 
 
 if __name__ == "__main__":